@@ -3,35 +3,333 @@ A chatbot implementation using Anthropic's Claude API with a custom MCP (Model C
 This module provides functionality to interact with Claude and execute various tools through an MCP server.
 """
 
-import subprocess
-import json
+import asyncio
+import functools
+import logging
 import os
-from anthropic import Anthropic
+import shlex
+import socket
+import threading
+import httpx
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from anthropic import AsyncAnthropic
 from dotenv import load_dotenv
 
-class MCPClient:
+import mcp_server
+from mcp_server import _BUFFER_SIZE, _dumps, _enlarge_pipe, _loads
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+# Separates the Content-Length header from the body of a message
+_HEADER_END = b'\r\n\r\n'
+
+logger = logging.getLogger(__name__)
+
+def _request_prefix(method):
+    """Serialize the part of a JSON-RPC request for method that precedes its params."""
+    return b'{"jsonrpc":"2.0","method":' + _dumps(method) + b',"params":'
+
+# Serialized request prefixes for the methods the client sends, and whole
+# requests (with a %d slot for the id) for those sent without params
+_REQUEST_PREFIXES = {method: _request_prefix(method) for method in ('initialize', 'tools/list', 'tools/call')}
+_EMPTY_REQUESTS = {method: prefix + b'{},"id":%d}' for method, prefix in _REQUEST_PREFIXES.items()}
+
+# Inputs that end the chat session
+_EXIT = frozenset({"exit", "quit", "q", ":q"})
+
+def _content_length(header):
+    """
+    Extract the body length from a message header block.
+
+    Args:
+        header (bytes): Header lines, e.g. b"Content-Length: 42\\r\\n\\r\\n"
+
+    Returns:
+        int: The value of the Content-Length header
+
+    Raises:
+        Exception: If the header block has no Content-Length
+    """
+    for line in header.split(b'\r\n'):
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            return int(value)
+    raise Exception("Missing Content-Length header")
+
+def _materialize(value):
+    """Convert a value from a simdjson document into plain Python objects."""
+    if isinstance(value, simdjson.Object):
+        return value.as_dict()
+    if isinstance(value, simdjson.Array):
+        return value.as_list()
+    return value
+
+class MCPClient(ABC):
+    """
+    A client for interacting with an MCP (Model Context Protocol) server.
+    Provides the tool execution and initialization calls on top of send_request,
+    which subclasses implement for a particular kind of server.
+    """
+
+    async def start(self):
+        """Start the connection to the server. Nothing to do by default."""
+
+    async def close(self):
+        """Close the connection to the server. Nothing to do by default."""
+
+    async def __aenter__(self):
+        """Start the connection to the server for the duration of an async with block."""
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        """Close the connection to the server, however the block was left."""
+        await self.close()
+
+    @abstractmethod
+    async def send_request(self, method, params=None):
+        """
+        Send a JSON-RPC request to the MCP server.
+
+        Args:
+            method (str): The RPC method name to call
+            params (dict, optional): Parameters for the RPC method. Defaults to None.
+
+        Returns:
+            dict: The result from the server
+
+        Raises:
+            Exception: If the server returns an error
+        """
+
+    async def initialize(self):
+        """Initialize the connection with the MCP server."""
+        return await self.send_request('initialize')
+
+    async def list_tools(self):
+        """Retrieve the list of available tools from the server."""
+        return await self.send_request('tools/list')
+
+    async def call_tool(self, name, input_data):
+        """
+        Call a specific tool on the MCP server.
+
+        Args:
+            name (str): Name of the tool to call
+            input_data (dict): Input parameters for the tool
+
+        Returns:
+            dict: The result from the tool execution
+        """
+        return await self.send_request('tools/call', {"name": name, "input": input_data})
+
+class SubprocessMCPClient(MCPClient):
     """
-    A client for interacting with the MCP (Model Context Protocol) server.
+    A client for an MCP server running as a child process.
     Handles JSON-RPC communication with the server for tool execution and initialization.
+
+    The server's stdin and stdout are one end of a Unix stream socket pair,
+    or pipes where Unix sockets are unavailable (e.g. Windows). Either way each
+    JSON-RPC message is preceded by a "Content-Length: N" header as in the
+    Language Server Protocol, so messages of any size can be sent.
+
+    A background task reads responses and resolves the pending request with the
+    same id, which lets several requests be in flight at once.
     """
 
     def __init__(self, server_command):
         """
         Initialize the MCP client with a server command.
 
+        The server is not started until start() is awaited.
+
         Args:
-            server_command (str): Command to start the MCP server
-        """
-        self.process = subprocess.Popen(
-            server_command,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            text=True,
-            shell=True
-        )
+            server_command (list): Program and arguments used to start the MCP server
+        """
+        self.server_command = server_command
+        self.process = None
+        self.sock = None
         self.request_id = 0
+        # Streams for the server's stdin and stdout
+        self._writer = None
+        self._stdout = None
+        self._pending = {}
+        self._reader = None
+        # Why the reader stopped; raised for requests made after that
+        self._reader_error = None
+        # Reused for every response; only available with pysimdjson installed
+        self._parser = simdjson.Parser() if simdjson is not None else None
+
+    async def start(self):
+        """Start the MCP server process and the background response reader."""
+        try:
+            self.sock, server_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        except (AttributeError, OSError):
+            server_sock = None
+
+        # Exec the server directly (no intermediate shell)
+        if server_sock is None:
+            self.process = await asyncio.create_subprocess_exec(
+                *self.server_command,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE
+            )
+            # Concurrent requests should not stall on the default 64 KiB pipe buffer;
+            # the server enlarges its own stdout pipe the same way
+            _enlarge_pipe(self.process.stdin.transport.get_extra_info('pipe').fileno())
+            self._writer = self.process.stdin
+            self._stdout = self.process.stdout
+        else:
+            with server_sock:
+                for sock in (self.sock, server_sock):
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, _BUFFER_SIZE)
+                self.process = await asyncio.create_subprocess_exec(
+                    *self.server_command,
+                    stdin=server_sock,
+                    stdout=server_sock
+                )
+            self._stdout, self._writer = await asyncio.open_connection(sock=self.sock)
+        self._reader = asyncio.create_task(self._read_responses())
+
+    async def close(self):
+        """Close the connection to the server and wait for the server process to exit."""
+        # The server sees end-of-file, exits, and the reader then sees ours
+        self._writer.write_eof()
+        await self.process.wait()
+        await self._reader
+        self._writer.close()
+
+    async def _send(self, message):
+        """
+        Send a serialized JSON-RPC message to the server.
 
-    def send_request(self, method, params=None):
+        Args:
+            message (bytes): The message to send
+        """
+        # Header and body go out in one writelines() call; the transport may
+        # hold on to the buffers it is given, so they must be immutable bytes
+        self._writer.writelines([b'Content-Length: %d\r\n\r\n' % len(message), message])
+        await self._writer.drain()
+
+    async def _receive(self):
+        """
+        Receive one serialized JSON-RPC message from the server.
+
+        Returns:
+            bytes: The message (possibly empty), or None once the server has
+                closed the connection
+        """
+        # Read the header, then exactly the body length it announces
+        try:
+            header = await self._stdout.readuntil(_HEADER_END)
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                return None
+            raise
+        return await self._stdout.readexactly(_content_length(header))
+
+    async def _read_responses(self):
+        """
+        Read responses from the server until it exits, resolving the pending
+        request future that matches each response id.
+
+        This task is the client's only reader and is driven by the event loop's
+        selector (epoll on Linux), so callers never block on the transport
+        themselves. A wakeup drains everything already queued: the stream
+        reader buffers all available bytes, so responses to concurrent
+        requests are dispatched back-to-back before the task waits again.
+        """
+        error = Exception("MCP server closed the connection")
+        try:
+            while True:
+                message = await self._receive()
+                if message is None:
+                    break
+                if not message:
+                    # An empty body answers no request
+                    continue
+                response = self._parse_response(message)
+                future = self._pending.pop(response.get('id'), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except Exception as e:
+            error = e
+        finally:
+            # Fail any requests that will never get a response
+            self._reader_error = error
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._pending.clear()
+
+    def _parse_response(self, message):
+        """
+        Parse a serialized JSON-RPC response.
+
+        With pysimdjson installed the document is walked in place and only the
+        id and the result or error are converted to Python objects; the rest of
+        the message is never materialized.
+
+        Args:
+            message (bytes): The serialized response
+
+        Returns:
+            dict: The response, with its "id" and either "result" or "error"
+        """
+        if self._parser is None:
+            return _loads(message)
+        # The parser is reused, so every proxy into the document must be
+        # converted before returning
+        doc = self._parser.parse(message)
+        response = {"id": doc.get('id')}
+        error = doc.get('error')
+        if error is not None:
+            response['error'] = _materialize(error)
+        else:
+            response['result'] = _materialize(doc.get('result'))
+        return response
+
+    def _make_request(self, method, params=None):
+        """
+        Serialize a JSON-RPC request with the next request id and register
+        a future that will receive its response.
+
+        The request is assembled from a pre-serialized per-method prefix, so
+        only params and the id are encoded per call. Requests without params
+        to a known method are a single template substitution.
+
+        Args:
+            method (str): The RPC method name to call
+            params (dict, optional): Parameters for the RPC method. Defaults to None.
+
+        Returns:
+            tuple: The serialized JSON-RPC request and the future for its response
+
+        Raises:
+            Exception: If the connection to the server has already ended
+        """
+        if self._reader.done():
+            # Nothing would ever resolve the future
+            raise Exception(str(self._reader_error)) from self._reader_error
+        self.request_id += 1
+        if params:
+            prefix = _REQUEST_PREFIXES.get(method) or _request_prefix(method)
+            request = prefix + _dumps(params) + b',"id":%d}' % self.request_id
+        else:
+            template = _EMPTY_REQUESTS.get(method)
+            if template is not None:
+                request = template % self.request_id
+            else:
+                request = _request_prefix(method) + b'{},"id":%d}' % self.request_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[self.request_id] = future
+        return request, future
+
+    async def send_request(self, method, params=None):
         """
         Send a JSON-RPC request to the MCP server.
 
@@ -45,172 +343,297 @@ class MCPClient:
         Raises:
             Exception: If the server returns an error
         """
-        self.request_id += 1
-        request = {
-            "jsonrpc": "2.0",
-            "id": self.request_id,
-            "method": method,
-            "params": params or {}
-        }
-        self.process.stdin.write(json.dumps(request) + '\n')
-        self.process.stdin.flush()
-
-        response_line = self.process.stdout.readline()
-        response = json.loads(response_line)
+        request, future = self._make_request(method, params)
+        request_id = self.request_id
+        try:
+            await self._send(request)
+        except BaseException:
+            # Nothing will answer a request that was not sent
+            self._pending.pop(request_id, None)
+            raise
+
+        response = await future
         if 'error' in response:
             raise Exception(response['error']['message'])
         return response['result']
 
-    def initialize(self):
-        """Initialize the connection with the MCP server."""
-        return self.send_request('initialize')
+class InProcessMCPClient(MCPClient):
+    """
+    A client for the tools in mcp_server, called directly in this process.
 
-    def list_tools(self):
-        """Retrieve the list of available tools from the server."""
-        return self.send_request('tools/list')
+    Requests are dispatched straight to mcp_server.handle_request, skipping
+    process startup and the JSON encoding and transport of every call. Tools
+    run on the event loop's thread, so this suits fast, local tools; use
+    SubprocessMCPClient for servers that live out of process.
+    """
 
-    def call_tool(self, name, input_data):
+    async def send_request(self, method, params=None):
         """
-        Call a specific tool on the MCP server.
+        Dispatch a JSON-RPC request to the in-process MCP server.
 
         Args:
-            name (str): Name of the tool to call
-            input_data (dict): Input parameters for the tool
+            method (str): The RPC method name to call
+            params (dict, optional): Parameters for the RPC method. Defaults to None.
 
         Returns:
-            dict: The result from the tool execution
+            dict: The result from the server
+
+        Raises:
+            Exception: If the server returns an error
         """
-        return self.send_request('tools/call', {"name": name, "input": input_data})
+        response = mcp_server.handle_request({"method": method, "params": params or {}})
+        if 'error' in response:
+            raise Exception(response['error']['message'])
+        return response['result']
+
+@dataclass(frozen=True)
+class Config:
+    """Chatbot settings read from the environment and the .env file."""
+
+    api_key: str | None
+    log_level: str
+    # Program and arguments of an out-of-process MCP server; empty to call the
+    # bundled tools in-process
+    server_command: tuple
 
-def main():
+@functools.lru_cache(maxsize=1)
+def _config():
     """
-    Main function to run the chatbot application.
-    Sets up the environment, initializes clients, and handles the chat loop.
+    Load the .env file and read the chatbot settings, once per process.
+
+    Returns:
+        Config: The settings
     """
-    # Load environment variables from .env file
     load_dotenv()
-    api_key = os.getenv('ANTHROPIC_API_KEY')
-    if not api_key:
+    log_level = os.getenv('LOG_LEVEL', 'WARNING').upper()
+    if log_level not in logging.getLevelNamesMapping():
+        # Unknown level names (e.g. "verbose") fall back to the default
+        log_level = 'WARNING'
+    return Config(
+        api_key=os.getenv('ANTHROPIC_API_KEY'),
+        log_level=log_level,
+        server_command=tuple(shlex.split(os.getenv('MCP_SERVER_COMMAND', '')))
+    )
+
+async def _read_input(prompt):
+    """
+    Read a line from stdin without blocking the event loop.
+
+    input() runs on a daemon thread rather than the default executor: asyncio.run()
+    waits for executor threads on exit, and one stuck in input() would keep
+    Ctrl-C at the prompt from ending the program.
+
+    Args:
+        prompt (str): Text written before reading
+
+    Returns:
+        str: The line read, without its trailing newline
+
+    Raises:
+        EOFError: If stdin is at end of file
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def settle(line, error):
+        # The prompt may have been cancelled meanwhile
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(line)
+
+    def read():
+        try:
+            line, error = input(prompt), None
+        except Exception as e:
+            line, error = None, e
+        loop.call_soon_threadsafe(settle, line, error)
+
+    threading.Thread(target=read, daemon=True).start()
+    return await future
+
+async def stream_response(client, mcp_client, **request):
+    """
+    Stream a response from Claude, printing its text as it arrives.
+
+    Each tool_use block is dispatched to the MCP server as soon as the block is
+    complete, so tools run while Claude is still emitting the rest of the message.
+    If the stream fails, any tool calls already dispatched are cancelled.
+
+    Args:
+        client (AsyncAnthropic): Client for the Claude API
+        mcp_client (MCPClient): Client used to execute tool calls
+        **request: Arguments passed through to client.messages.stream
+
+    Returns:
+        tuple: The final message, the tool_use blocks it contains and the tasks
+            executing those tool calls
+    """
+    tool_calls = []
+    tool_tasks = []
+    printed_text = False
+    try:
+        async with client.messages.stream(**request) as stream:
+            # Single pass over the events: text is printed, tool_use blocks are
+            # dispatched, everything else is skipped
+            async for event in stream:
+                event_type = event.type
+                if event_type == "text":
+                    if not printed_text:
+                        print("Assistant: ", end="", flush=True)
+                        printed_text = True
+                    print(event.text, end="", flush=True)
+                elif event_type == "content_block_stop":
+                    # Keep the block itself rather than copying its fields out
+                    block = event.content_block
+                    if block.type == "tool_use":
+                        tool_calls.append(block)
+                        tool_tasks.append(asyncio.create_task(mcp_client.call_tool(block.name, block.input)))
+            message = await stream.get_final_message()
+    except BaseException:
+        # Don't leave tool calls running for a response that failed
+        for task in tool_tasks:
+            task.cancel()
+        await asyncio.gather(*tool_tasks, return_exceptions=True)
+        raise
+    finally:
+        if printed_text:
+            print()
+    return message, tool_calls, tool_tasks
+
+async def main():
+    """
+    Main coroutine to run the chatbot application.
+    Sets up the environment, initializes clients, and handles the chat loop.
+    """
+    # Load settings from the environment and .env file
+    config = _config()
+    if not config.api_key:
         print("Error: ANTHROPIC_API_KEY not found in .env file")
         return
 
-    # Initialize Anthropic client for Claude API
-    client = Anthropic(api_key=api_key)
-
-    # Initialize MCP client and get available tools
-    mcp_client = MCPClient("python mcp_server.py")
-    mcp_client.initialize()
-    tools_response = mcp_client.list_tools()
-    tools = tools_response['tools']
-    print(f"Available tools: {[tool['name'] for tool in tools]}")
-
-    # Main chat loop
-    while True:
-        user_input = input("User: ")
-        if user_input.lower() == "exit":
-            break
-
-        # Initialize conversation with user's input
-        messages = [{"role": "user", "content": user_input}]
-        
-        # Continue getting responses until we have a complete interaction
+    # Checked once so disabled diagnostics cost nothing in the chat loop
+    debug = logger.isEnabledFor(logging.DEBUG)
+
+    # Initialize Anthropic client for Claude API on a pooled HTTP/2 connection,
+    # so every request in the chat loop reuses the same TLS session
+    http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=10, max_connections=20, keepalive_expiry=60.0)
+    )
+    client = AsyncAnthropic(
+        api_key=config.api_key,
+        http_client=http_client,
+        default_headers={"anthropic-beta": "prompt-caching-2024-07-31"}
+    )
+
+    # Initialize MCP client and get available tools; the bundled tools are
+    # called in-process unless a server command is configured
+    if config.server_command:
+        mcp_client = SubprocessMCPClient(list(config.server_command))
+    else:
+        mcp_client = InProcessMCPClient()
+    # Both clients are closed however the session ends (exit, EOF, Ctrl-C or an error)
+    async with client, mcp_client:
+        await mcp_client.initialize()
+        tools_response = await mcp_client.list_tools()
+        tools = tools_response['tools']
+        # The tool list is static for the session, so mark it as a prompt-cache
+        # breakpoint; later requests reuse the cached schema instead of reprocessing it
+        # (copying the entry, since an in-process server shares its tool list)
+        if tools:
+            tools = [*tools[:-1], {**tools[-1], "cache_control": {"type": "ephemeral"}}]
+        if debug:
+            logger.debug("Available tools: %s", [tool['name'] for tool in tools])
+
+        # Main chat loop
         while True:
-            try:
-                # Get initial response from Claude
-                response = client.messages.create(
-                    model="claude-3-5-sonnet-20240620",
-                    max_tokens=1024,
-                    messages=messages,
-                    tools=tools
-                )
-                
-                # Process any tool calls in the response
-                has_tool_calls = False
-                tool_calls = []
-                
-                # Extract tool calls from response blocks
-                for block in response.content:
-                    if block.type == 'tool_use':
-                        has_tool_calls = True
-                        tool_calls.append({
-                            "name": block.name,
-                            "input": block.input,
-                            "id": block.id
-                        })
-                
-                if has_tool_calls:
-                    print(f"Found {len(tool_calls)} tool calls")
+            user_input = await _read_input("User: ")
+            if user_input.strip().casefold() in _EXIT:
+                break
+
+            # Initialize conversation with user's input
+            messages = [{"role": "user", "content": user_input}]
+            
+            # Continue getting responses until we have a complete interaction.
+            # Every request sends the same tool list, so the follow-ups to tool
+            # results hit its prompt-cache breakpoint too
+            model = "claude-3-5-sonnet-20240620"
+            failure = "Failed to process the response. Please try again."
+            while True:
+                try:
+                    # Stream the next response from Claude; tool calls are
+                    # dispatched to the MCP server as soon as each block completes
+                    response, tool_calls, tool_tasks = await stream_response(
+                        client,
+                        mcp_client,
+                        model=model,
+                        max_tokens=1024,
+                        messages=messages,
+                        tools=tools
+                    )
+                    
+                    if not tool_calls:
+                        # Responses without tool calls were already printed while streaming
+                        break
+                    
+                    if debug:
+                        logger.debug("Found %d tool calls", len(tool_calls))
                     # Add Claude's response with tool calls to conversation
                     messages.append({"role": "assistant", "content": response.content})
                     
-                    # Execute each tool call and add results to conversation
-                    for tool_call in tool_calls:
-                        try:
-                            # Execute the tool
-                            tool_result = mcp_client.call_tool(tool_call["name"], tool_call["input"])
-                            print(f"Tool {tool_call['name']} result: {tool_result}")
-                            
-                            # Add tool result to conversation
-                            tool_result_message = {
-                                "role": "user",
-                                "content": [
-                                    {
-                                        "type": "tool_result",
-                                        "tool_use_id": tool_call["id"],
-                                        "content": tool_result
-                                    }
-                                ]
-                            }
-                            
-                            messages.append(tool_result_message)
-                        except Exception as e:
+                    # Collect the results of the already-running tool calls and add them to conversation
+                    results = await asyncio.gather(*tool_tasks, return_exceptions=True)
+                    for tool_call, tool_result in zip(tool_calls, results):
+                        if isinstance(tool_result, Exception):
                             # Handle tool execution errors
-                            print(f"Error processing tool call {tool_call['name']}: {e}")
+                            logger.error("Error processing tool call %s: %s", tool_call.name, tool_result)
                             error_message = {
                                 "role": "user",
                                 "content": [
                                     {
                                         "type": "tool_result",
-                                        "tool_use_id": tool_call["id"],
-                                        "content": f"Error: {str(e)}",
+                                        "tool_use_id": tool_call.id,
+                                        "content": f"Error: {str(tool_result)}",
                                         "is_error": True
                                     }
                                 ]
                             }
                             messages.append(error_message)
-                    
-                    # Get final response after tool execution
-                    try:
-                        final_response = client.messages.create(
-                            model="claude-3-7-sonnet-20250219",
-                            max_tokens=1024,
-                            messages=messages
-                        )
+                            continue
+
+                        if debug:
+                            logger.debug("Tool %s result: %s", tool_call.name, tool_result)
+                        
+                        # Add tool result to conversation
+                        tool_result_message = {
+                            "role": "user",
+                            "content": [
+                                {
+                                    "type": "tool_result",
+                                    "tool_use_id": tool_call.id,
+                                    "content": tool_result
+                                }
+                            ]
+                        }
                         
-                        # Extract and print text from final response
-                        response_text = ""
-                        for block in final_response.content:
-                            if block.type == "text":
-                                response_text += block.text
-                        print("Assistant:", response_text)
-                    except Exception as e:
-                        print(f"Error: {e}")
-                        print("Failed to process the tool results. Please try again.")
+                        messages.append(tool_result_message)
                     
-                    break
-                else:
-                    # Handle responses without tool calls
-                    response_text = ""
-                    for block in response.content:
-                        if block.type == "text":
-                            response_text += block.text
-                    print("Assistant:", response_text)
-                    break
+                    # Stream the response to the tool results next; it may call
+                    # further tools, which go round this loop again
+                    model = "claude-3-7-sonnet-20250219"
+                    failure = "Failed to process the tool results. Please try again."
                     
-            except Exception as e:
-                print(f"Error: {e}")
-                print("Failed to process the response. Please try again.")
-                break
+                except Exception as e:
+                    print(f"Error: {e}")
+                    print(failure)
+                    break
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    # LOG_LEVEL only applies to the chatbot's own logger; library loggers
+    # (httpx, h2, ...) stay at WARNING
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(_config().log_level)
+    asyncio.run(main())
\ No newline at end of file
@@ -9,62 +9,262 @@ The server currently implements a simple get_current_time tool as an example,
 but can be extended to support additional tools as needed.
 """
 
-import json
+import re
 import sys
-import datetime
+import time
+
+try:
+    import orjson
+
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+    _JSONDecodeError = orjson.JSONDecodeError
+except ImportError:
+    import json as _json
+
+    def _dumps(obj):
+        """Serialize obj to compact JSON bytes, mirroring orjson.dumps."""
+        return _json.dumps(obj, separators=(",", ":")).encode()
+
+    def _loads(data):
+        """Parse JSON from bytes-like data, mirroring orjson.loads."""
+        return _json.loads(bytes(data))
+    _JSONDecodeError = _json.JSONDecodeError
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+# Kernel buffer size requested for the pipes or socket carrying MCP messages
+# (also used by the client in chatbot.py)
+_BUFFER_SIZE = 1 << 20
+
+# A "Name: value" header line in the stdio framing
+_HEADER_LINE = re.compile(rb"[!#$%&'*+.^_`|~0-9A-Za-z-]+:[^\r\n]*\r?\n")
+
+
+def _enlarge_pipe(fd):
+    """Grow the kernel buffer of the pipe behind fd to _BUFFER_SIZE, where supported."""
+    if fcntl is None or not hasattr(fcntl, 'F_SETPIPE_SZ'):
+        return
+    try:
+        fcntl.fcntl(fd, fcntl.F_SETPIPE_SZ, _BUFFER_SIZE)
+    except OSError:
+        # Not a pipe, or larger than /proc/sys/fs/pipe-max-size
+        pass
+
+# Second and formatted string of the last get_current_time() call
+_last_time = [0, ""]
 
 def get_current_time():
     """
     Get the current date and time in a standardized format.
     
+    The formatted string only changes once per second, so it is cached and
+    reused for calls made within the same second.
+    
     Returns:
         str: Current date and time in the format "YYYY-MM-DD HH:MM:SS"
     """
-    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    second = int(time.time())
+    if second != _last_time[0]:
+        _last_time[0] = second
+        _last_time[1] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+    return _last_time[1]
+
+# Results for methods whose answer never changes during a session
+_INIT_RESULT = {"protocolVersion": "2025-03-26", "capabilities": {}}
+_TOOLS_LIST_RESULT = {
+    "tools": [
+        {
+            "name": "get_current_time",
+            "description": "Get the current date and time",
+            "input_schema": {"type": "object", "properties": {}}
+        }
+    ]
+}
+
+_INIT_RESPONSE = {"result": _INIT_RESULT}
+_TOOLS_LIST_RESPONSE = {"result": _TOOLS_LIST_RESULT}
+_METHOD_NOT_FOUND = {"error": {"code": -32601, "message": "Method not found"}}
+
+# Pre-serialized responses for the static methods above; main() only has to
+# splice in the request id
+_STATIC_RESPONSES = {
+    'initialize': _dumps(_INIT_RESPONSE),
+    'tools/list': _dumps(_TOOLS_LIST_RESPONSE),
+}
+
+# Answer to a message that is valid JSON but not a request object
+_INVALID_REQUEST = _dumps({
+    "jsonrpc": "2.0",
+    "id": None,
+    "error": {"code": -32600, "message": "Invalid Request"}
+})
+
+def _with_id(body, request_id):
+    """
+    Add the request id to a serialized response.
+
+    Args:
+        body (bytes): A serialized JSON object (ending in '}')
+        request_id: The id of the request being answered
+
+    Returns:
+        bytes: The serialized response including its id
+    """
+    return body[:-1] + b',"id":' + _dumps(request_id) + b'}'
+
+def _handle_initialize(request):
+    """Return the protocol version and capabilities."""
+    return _INIT_RESPONSE
+
+def _handle_tools_list(request):
+    """Return the available tools and their schemas."""
+    return _TOOLS_LIST_RESPONSE
+
+def _handle_tools_call(request):
+    """Execute the requested tool with the input supplied by the client."""
+    params = request.get('params', {})
+    tool = _TOOLS.get(params.get('name'))
+    if tool is None:
+        return _METHOD_NOT_FOUND
+    return {"result": tool(**params.get('input', {}))}
+
+# Tool name -> implementation
+_TOOLS = {
+    'get_current_time': get_current_time,
+}
+
+# JSON-RPC method -> handler
+_HANDLERS = {
+    'initialize': _handle_initialize,
+    'tools/list': _handle_tools_list,
+    'tools/call': _handle_tools_call,
+}
 
 def handle_request(request):
     """
     Handle incoming JSON-RPC requests from the MCP client.
     
-    This function processes different types of requests:
+    This function dispatches different types of requests:
     - initialize: Protocol initialization
     - tools/list: List available tools
     - tools/call: Execute a specific tool
     
+    The returned dict may be shared between calls and must not be mutated.
+    
     Args:
         request (dict): The JSON-RPC request to process
         
     Returns:
         dict: The JSON-RPC response containing either the result or an error
     """
-    method = request.get('method')
+    handler = _HANDLERS.get(request.get('method'))
+    if handler is None:
+        return _METHOD_NOT_FOUND
+    return handler(request)
+
+def process_message(message):
+    """
+    Parse one serialized JSON-RPC request and build its serialized response.
     
-    if method == 'initialize':
-        # Return protocol version and capabilities
-        return {"result": {"protocolVersion": "2025-03-26", "capabilities": {}}}
-    elif method == 'tools/list':
-        # Define available tools and their schemas
-        tools = [
-            {
-                "name": "get_current_time",
-                "description": "Get the current date and time",
-                "input_schema": {"type": "object", "properties": {}}
-            }
-        ]
-        return {"result": {"tools": tools}}
-    elif method == 'tools/call':
-        # Extract tool name and parameters
-        params = request.get('params', {})
-        tool_name = params.get('name')
+    Args:
+        message (bytes): The serialized request (any bytes-like object)
+        
+    Returns:
+        bytes: The serialized response, or None if message is not valid JSON
+    """
+    try:
+        # Parse and process the request; static methods skip straight to
+        # their pre-serialized response
+        request = _loads(message)
+        if not isinstance(request, dict):
+            return _INVALID_REQUEST
+        body = _STATIC_RESPONSES.get(request.get('method'))
+        if body is None:
+            body = _dumps(handle_request(request))
+        
+        # Add request ID to response
+        return _with_id(body, request.get('id'))
         
-        # Execute the requested tool
-        if tool_name == 'get_current_time':
-            result = get_current_time()
-            return {"result": result}
+    except _JSONDecodeError:
+        # Ignore invalid JSON input
+        return None
+    except Exception as e:
+        # Handle other errors
+        error_response = {
+            "jsonrpc": "2.0", 
+            "id": request.get('id'),
+            "error": {"code": -32603, "message": f"Internal error: {str(e)}"}
+        }
+        return _dumps(error_response)
+
+def _read_message(stdin):
+    """
+    Read one Content-Length framed message from a binary stream.
+    
+    Header lines are read up to the blank line that ends them, then exactly
+    Content-Length bytes of body are read in one call.
+    
+    Args:
+        stdin: Binary stream to read from
+        
+    Returns:
+        bytes: The message body (possibly empty), or None at end of input
+        
+    Raises:
+        ValueError: If a header line is malformed or the header block has no
+            valid Content-Length; the offending line is consumed
+    """
+    length = None
+    while True:
+        line = stdin.readline()
+        if not line:
+            return None
+        if line in (b'\r\n', b'\n'):
+            if length is None:
+                raise ValueError("Missing Content-Length header")
+            return stdin.read(length)
+        if not _HEADER_LINE.fullmatch(line):
+            raise ValueError(f"Expected a header line, got {line[:40]!r}")
+        name, _, value = line.partition(b':')
+        if name.lower() == b'content-length':
+            value = value.strip()
+            if not value.isdigit():
+                raise ValueError(f"Invalid Content-Length {value[:20]!r}")
+            length = int(value)
+
+def _serve_stdio(stdin, stdout):
+    """
+    Serve Content-Length framed requests from stdin, writing responses to stdout.
+    
+    Malformed framing is answered with a JSON-RPC parse error rather than
+    silently skipped.
+    
+    Args:
+        stdin: Binary stream to read requests from
+        stdout: Binary stream to write responses to
+    """
+    _enlarge_pipe(stdout.fileno())
+    while True:
+        try:
+            message = _read_message(stdin)
+        except ValueError as e:
+            response = _dumps({
+                "jsonrpc": "2.0",
+                "id": None,
+                "error": {"code": -32700, "message": f"Parse error: {e}"}
+            })
         else:
-            return {"error": {"code": -32601, "message": "Method not found"}}
-    else:
-        return {"error": {"code": -32601, "message": "Method not found"}}
+            if message is None:
+                break
+            response = process_message(message)
+        if response is not None:
+            stdout.write(b'Content-Length: %d\r\n\r\n' % len(response))
+            stdout.write(response)
+            stdout.flush()
 
 def main():
     """
@@ -72,40 +272,15 @@ def main():
     
     This function:
     1. Reads JSON-RPC requests from stdin
-    2. Processes each request using handle_request
+    2. Processes each request using process_message
     3. Writes responses to stdout
-    4. Handles errors gracefully
+    
+    Requests and responses are each preceded by a "Content-Length: N" header
+    and a blank line, as in the Language Server Protocol. stdin and stdout
+    may be pipes or, as set up by SubprocessMCPClient, one end of a Unix
+    stream socket pair; the framing is the same either way.
     """
-    while True:
-        # Read a line from stdin
-        line = sys.stdin.readline()
-        if not line:
-            break
-            
-        try:
-            # Parse and process the request
-            request = json.loads(line)
-            response = handle_request(request)
-            
-            # Add request ID to response
-            response['id'] = request.get('id')
-            
-            # Send response to stdout
-            print(json.dumps(response))
-            sys.stdout.flush()
-            
-        except json.JSONDecodeError:
-            # Handle invalid JSON input
-            pass
-        except Exception as e:
-            # Handle other errors
-            error_response = {
-                "jsonrpc": "2.0", 
-                "id": request.get('id'),
-                "error": {"code": -32603, "message": f"Internal error: {str(e)}"}
-            }
-            print(json.dumps(error_response))
-            sys.stdout.flush()
+    _serve_stdio(sys.stdin.buffer, sys.stdout.buffer)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()